@@ -2,18 +2,27 @@
 Agentic sampling loop that supports both Anthropic API and Google's Gemini API, with local implementation of computer use tools.
 """
 
+import asyncio
+import base64
+import hashlib
+import io
 import platform
 from collections.abc import Callable
 from datetime import datetime
 from enum import StrEnum
 from typing import Any, cast
-import json
 
-from anthropic import Anthropic, AnthropicBedrock, AnthropicVertex, APIResponse
+from anthropic import (
+    APIResponse,
+    AsyncAnthropic,
+    AsyncAnthropicBedrock,
+    AsyncAnthropicVertex,
+)
 from anthropic.types import (
     ToolResultBlockParam,
 )
 from anthropic.types.beta import (
+    BetaCacheControlEphemeralParam,
     BetaContentBlock,
     BetaContentBlockParam,
     BetaImageBlockParam,
@@ -25,10 +34,22 @@ from anthropic.types.beta import (
 
 import google.generativeai as genai
 from google.generativeai.types import FunctionDeclaration
+from PIL import Image, features
 
+from response_cache import ExactResponseCache, SemanticResponseCache
 from tools import BashTool, ComputerTool, EditTool, ToolCollection, ToolResult
 
 BETA_FLAG = "computer-use-2024-10-22"
+PROMPT_CACHING_BETA_FLAG = "prompt-caching-2024-07-31"
+
+# Anthropic downsizes anything larger before the model sees it, so larger
+# screenshots only cost upload bandwidth
+MAX_IMAGE_DIMENSION = 1568
+JPEG_QUALITY = 85
+# WebP is usually a fair bit smaller than JPEG for screenshots at the same quality;
+# JPEG is only used when Pillow was built without WebP support
+WEBP_QUALITY = 80
+WEBP_SUPPORTED = features.check("webp")
 
 
 class APIProvider(StrEnum):
@@ -65,6 +86,10 @@ PROVIDER_TO_DEFAULT_MODEL_NAME: dict[APIProvider, str] = {
 # * When using Chrome, if any first-time setup dialogs appear, IGNORE THEM. Instead, click directly in the address bar and enter the appropriate search term or URL there.
 # * If the item you are looking at is a pdf, if after taking a single screenshot of the pdf it seems that you want to read the entire document instead of trying to continue to read the pdf from your screenshots + navigation, determine the URL, use curl to download the pdf, install and use pdftotext (available via homebrew) to convert it to a text file, and then read that text file directly with your StrReplaceEditTool.
 # </IMPORTANT>"""
+# The prompt is split in two: SYSTEM_PROMPT never changes and is sent as its own
+# cached block, while the date (filled in per sampling_loop call, so a long-running
+# app doesn't serve a stale one) and any custom suffix go in a second, uncached
+# block. A new date or suffix then leaves the cached static block intact.
 SYSTEM_PROMPT = f"""<SYSTEM_CAPABILITY>
 * You are utilizing a macOS Sonoma 15.7 environment using {platform.machine()} architecture with command line internet access.
 * Package management:
@@ -98,7 +123,8 @@ SYSTEM_PROMPT = f"""<SYSTEM_CAPABILITY>
 
 * Note: Command line function calls may have latency. Chain multiple operations into single requests where feasible.
 
-* The current date is {datetime.today().strftime('%A, %B %-d, %Y')}.
+"""
+SYSTEM_PROMPT_DATE_TEMPLATE = """* The current date is {date}.
 </SYSTEM_CAPABILITY>"""
 
 async def sampling_loop(
@@ -112,139 +138,235 @@ async def sampling_loop(
     api_response_callback: Callable[[APIResponse[BetaMessage]], None],
     api_key: str,
     only_n_most_recent_images: int | None = None,
+    only_n_most_recent_full_images: int | None = None,
     max_tokens: int = 4096,
+    stream: bool = False,
+    semantic_cache: SemanticResponseCache | None = None,
+    response_cache: ExactResponseCache | None = None,
 ):
     """
     Agentic sampling loop for the assistant/tool interaction using either Anthropic or Gemini API.
+
+    With `stream` set, Anthropic responses are streamed and each tool starts running
+    as soon as its tool_use block is complete, instead of after the whole message.
+    With `semantic_cache` set, non-streamed Anthropic replies to user text similar to
+    earlier text replay the cached assistant turn instead of calling the API. With `response_cache`
+    set, non-streamed requests identical to an earlier one replay its assistant turn.
     """
     tool_collection = ToolCollection(
         ComputerTool(),
         BashTool(),
         EditTool(),
     )
-    system = (
-        f"{SYSTEM_PROMPT}{' ' + system_prompt_suffix if system_prompt_suffix else ''}"
+    system_tail = (
+        SYSTEM_PROMPT_DATE_TEMPLATE.format(
+            date=datetime.today().strftime('%A, %B %-d, %Y')
+        )
+        + (f" {system_prompt_suffix}" if system_prompt_suffix else "")
     )
+    system = SYSTEM_PROMPT + system_tail
+
+    # Clients and tool schemas don't change between turns, so build them once
+    if provider == APIProvider.GEMINI:
+        genai.configure(api_key=api_key)
+        gemini_model = genai.GenerativeModel(model_name=model)
+        # Convert tools to Gemini function declarations
+        gemini_tools = [tool.gemini_tool for tool in tool_collection.tools]
+        # Gemini-format history, extended with only the messages added each turn
+        gemini_history: list[dict[str, Any]] = []
+        gemini_history_len = 0
+    else:
+        if provider == APIProvider.ANTHROPIC:
+            client = AsyncAnthropic(api_key=api_key)
+        elif provider == APIProvider.VERTEX:
+            client = AsyncAnthropicVertex()
+        elif provider == APIProvider.BEDROCK:
+            client = AsyncAnthropicBedrock()
+        tool_params = tool_collection.to_params()
+        betas = [BETA_FLAG]
+        system_param: str | list[BetaTextBlockParam] = system
+        enable_prompt_caching = provider == APIProvider.ANTHROPIC
+        if enable_prompt_caching:
+            # The static system prompt and tool definitions are identical on every
+            # turn, so cache them as a shared prefix
+            betas.append(PROMPT_CACHING_BETA_FLAG)
+            system_param = [
+                {
+                    "type": "text",
+                    "text": SYSTEM_PROMPT,
+                    "cache_control": BetaCacheControlEphemeralParam(type="ephemeral"),
+                },
+                {"type": "text", "text": system_tail},
+            ]
+            tool_params[-1] = {
+                **tool_params[-1],
+                "cache_control": BetaCacheControlEphemeralParam(type="ephemeral"),
+            }
 
     while True:
+        if only_n_most_recent_full_images:
+            _maybe_summarize_old_images(messages, only_n_most_recent_full_images)
         if only_n_most_recent_images:
             _maybe_filter_to_n_most_recent_images(messages, only_n_most_recent_images)
 
         if provider == APIProvider.GEMINI:
-            # Configure Gemini
-            genai.configure(api_key=api_key)
-            model = genai.GenerativeModel(model_name=model)
-
-            # Convert tools to Gemini function declarations
-            tools = [tool.to_gemini_tool() for tool in tool_collection.tools]
-
-            # Convert messages to Gemini format
-            gemini_messages = []
-            for msg in messages:
+            # Convert messages added since the previous turn to Gemini format
+            for msg in messages[gemini_history_len:]:
                 if msg["role"] == "user":
-                    content = msg["content"]
-                    if isinstance(content, list):
-                        # Handle tool results
-                        text_content = "\n".join(
-                            block.get("text", "") 
-                            for block in content 
-                            if isinstance(block, dict) and block.get("type") == "text"
-                        )
-                        gemini_messages.append({"role": "user", "parts": [text_content]})
-                    else:
-                        gemini_messages.append({"role": "user", "parts": [content]})
-                elif msg["role"] == "assistant":
-                    content = msg["content"]
-                    if isinstance(content, list):
-                        text_content = "\n".join(
-                            block.get("text", "") 
-                            for block in content 
-                            if isinstance(block, dict) and block.get("type") == "text"
-                        )
-                        gemini_messages.append({"role": "model", "parts": [text_content]})
-
-            # Call Gemini API
-            chat = model.start_chat(history=gemini_messages)
-            response = chat.send_message(
-                system,
-                tools=tools,
-                generation_config={"max_output_tokens": max_tokens}
-            )
-
-            # Convert Gemini response to our format
-            content_blocks = []
-            if response.text:
-                content_blocks.append({
-                    "type": "text",
-                    "text": response.text
-                })
+                    # tool results carry no text blocks and map to an empty part
+                    gemini_history.append(
+                        {"role": "user", "parts": [_extract_text(msg["content"])]}
+                    )
+                elif msg["role"] == "assistant" and isinstance(msg["content"], list):
+                    gemini_history.append(
+                        {"role": "model", "parts": [_extract_text(msg["content"])]}
+                    )
 
-            if response.candidates[0].function_calls:
-                for tool_call in response.candidates[0].function_calls:
+            gemini_history_len = len(messages)
+
+            content_blocks = None
+            if response_cache:
+                cache_key = await asyncio.to_thread(
+                    response_cache.key,
+                    model,
+                    system,
+                    tool_collection.to_params(),
+                    messages,
+                )
+                content_blocks = response_cache.get(cache_key)
+
+            if content_blocks is None:
+                # Call Gemini API. The chat is not reused across turns: send_message
+                # would record the system prompt and raw response in its own history,
+                # while ours is rebuilt from `messages`.
+                chat = gemini_model.start_chat(history=gemini_history)
+                response = await chat.send_message_async(
+                    system,
+                    tools=gemini_tools,
+                    generation_config={"max_output_tokens": max_tokens}
+                )
+
+                # Convert Gemini response to our format
+                content_blocks = []
+                if response.text:
                     content_blocks.append({
-                        "type": "tool_use",
-                        "id": f"tool_{len(messages)}",
-                        "name": tool_call.name,
-                        "input": json.loads(tool_call.args)
+                        "type": "text",
+                        "text": response.text
                     })
 
+                if response.candidates[0].function_calls:
+                    for i, tool_call in enumerate(response.candidates[0].function_calls):
+                        content_blocks.append({
+                            "type": "tool_use",
+                            "id": f"tool_{len(messages)}_{i}",
+                            "name": tool_call.name,
+                            # args is a proto Struct, not a JSON string; dict() would
+                            # leave nested lists and objects as proto types
+                            "input": _restore_ints(
+                                type(tool_call).to_dict(tool_call).get("args", {})
+                            )
+                        })
+
+                if response_cache:
+                    response_cache.put(cache_key, content_blocks)
+
             messages.append({
                 "role": "assistant",
                 "content": content_blocks
             })
 
-            tool_result_content = []
+            tool_uses = []
             for content_block in content_blocks:
                 output_callback(content_block)
                 if content_block["type"] == "tool_use":
-                    result = await tool_collection.run(
-                        name=content_block["name"],
-                        tool_input=content_block["input"],
-                    )
-                    tool_result_content.append(
-                        _make_api_tool_result(result, content_block["id"])
+                    tool_uses.append(
+                        (
+                            content_block["id"],
+                            content_block["name"],
+                            content_block["input"],
+                        )
                     )
-                    tool_output_callback(result, content_block["id"])
 
-        else:
-            # Original Anthropic logic
-            if provider == APIProvider.ANTHROPIC:
-                client = Anthropic(api_key=api_key)
-            elif provider == APIProvider.VERTEX:
-                client = AnthropicVertex()
-            elif provider == APIProvider.BEDROCK:
-                client = AnthropicBedrock()
-
-            raw_response = client.beta.messages.with_raw_response.create(
-                max_tokens=max_tokens,
-                messages=messages,
-                model=model,
-                system=system,
-                tools=tool_collection.to_params(),
-                betas=[BETA_FLAG],
+            tool_result_content = await _run_tools(
+                tool_collection, tool_uses, tool_output_callback
             )
 
-            api_response_callback(cast(APIResponse[BetaMessage], raw_response))
-            response = raw_response.parse()
+        else:
+            # Original Anthropic logic
+            if enable_prompt_caching:
+                _inject_prompt_caching(messages)
+
+            if stream:
+                response, tool_tasks = await _stream_and_dispatch_tools(
+                    client,
+                    tool_collection,
+                    output_callback,
+                    tool_output_callback,
+                    max_tokens=max_tokens,
+                    messages=messages,
+                    model=model,
+                    system=system_param,
+                    tools=tool_params,
+                    betas=betas,
+                )
+                messages.append({
+                    "role": "assistant",
+                    "content": cast(list[BetaContentBlockParam], response.content),
+                })
+                tool_result_content = list(await asyncio.gather(*tool_tasks))
 
-            messages.append({
-                "role": "assistant",
-                "content": cast(list[BetaContentBlockParam], response.content),
-            })
+            else:
+                response_content = None
+                if response_cache:
+                    cache_key = await asyncio.to_thread(
+                        response_cache.key, model, system, tool_params, messages
+                    )
+                    response_content = response_cache.get(cache_key)
 
-            tool_result_content = []
-            for content_block in cast(list[BetaContentBlock], response.content):
-                print("CONTENT", content_block)
-                output_callback(content_block)
-                if content_block.type == "tool_use":
-                    result = await tool_collection.run(
-                        name=content_block.name,
-                        tool_input=cast(dict[str, Any], content_block.input),
+                if response_content is None and semantic_cache:
+                    response_content = await asyncio.to_thread(
+                        semantic_cache.lookup, system, messages
                     )
-                    tool_result_content.append(
-                        _make_api_tool_result(result, content_block.id)
+
+                if response_content is None:
+                    raw_response = await client.beta.messages.with_raw_response.create(
+                        max_tokens=max_tokens,
+                        messages=messages,
+                        model=model,
+                        system=system_param,
+                        tools=tool_params,
+                        betas=betas,
                     )
-                    tool_output_callback(result, content_block.id)
+
+                    api_response_callback(cast(APIResponse[BetaMessage], raw_response))
+                    response_content = raw_response.parse().content
+                    if response_cache:
+                        response_cache.put(cache_key, response_content)
+                    if semantic_cache:
+                        await asyncio.to_thread(
+                            semantic_cache.store, system, messages, response_content
+                        )
+
+                messages.append({
+                    "role": "assistant",
+                    "content": cast(list[BetaContentBlockParam], response_content),
+                })
+
+                tool_uses = []
+                for content_block in cast(list[BetaContentBlock], response_content):
+                    output_callback(content_block)
+                    if content_block.type == "tool_use":
+                        tool_uses.append(
+                            (
+                                content_block.id,
+                                content_block.name,
+                                cast(dict[str, Any], content_block.input),
+                            )
+                        )
+
+                tool_result_content = await _run_tools(
+                    tool_collection, tool_uses, tool_output_callback
+                )
 
         if not tool_result_content:
             return messages
@@ -252,6 +374,240 @@ async def sampling_loop(
         messages.append({"content": tool_result_content, "role": "user"})
 
 
+async def _stream_and_dispatch_tools(
+    client: AsyncAnthropic | AsyncAnthropicVertex | AsyncAnthropicBedrock,
+    tool_collection: ToolCollection,
+    output_callback: Callable[[BetaContentBlock], None],
+    tool_output_callback: Callable[[ToolResult, str], None],
+    **create_kwargs: Any,
+) -> tuple[BetaMessage, list[asyncio.Task[BetaToolResultBlockParam]]]:
+    """
+    Stream an Anthropic response, handing each tool_use block to a _ToolScheduler as
+    soon as the block is complete. Returns the final message and the tool tasks, in
+    the order the model emitted them.
+    """
+    scheduler = _ToolScheduler(tool_collection, tool_output_callback)
+    try:
+        async with client.beta.messages.stream(**create_kwargs) as message_stream:
+            async for event in message_stream:
+                if event.type != "content_block_stop":
+                    continue
+                content_block = message_stream.current_message_snapshot.content[
+                    event.index
+                ]
+                output_callback(content_block)
+                if content_block.type == "tool_use":
+                    scheduler.submit(
+                        content_block.id,
+                        content_block.name,
+                        cast(dict[str, Any], content_block.input),
+                    )
+            response = await message_stream.get_final_message()
+    except BaseException:
+        # the turn is lost, so don't leave tools acting on the machine unobserved
+        for task in scheduler.tasks:
+            task.cancel()
+        await asyncio.gather(*scheduler.tasks, return_exceptions=True)
+        raise
+    return response, scheduler.tasks
+
+
+class _ToolScheduler:
+    """
+    Starts a turn's tool calls in the order the model emitted them. All tools act on
+    the same machine, so every call waits for the last state-changing call before
+    it, and a state-changing call also waits for the read-only calls since then.
+    Only consecutive read-only calls (screenshots, file views) overlap.
+    """
+
+    def __init__(
+        self,
+        tool_collection: ToolCollection,
+        tool_output_callback: Callable[[ToolResult, str], None],
+    ):
+        self._tool_collection = tool_collection
+        self._tool_output_callback = tool_output_callback
+        self.tasks: list[asyncio.Task[BetaToolResultBlockParam]] = []
+        self._last_write: asyncio.Task[BetaToolResultBlockParam] | None = None
+        self._reads_since_write: list[asyncio.Task[BetaToolResultBlockParam]] = []
+
+    def submit(self, tool_use_id: str, name: str, tool_input: dict[str, Any]):
+        read_only = self._tool_collection.is_read_only(
+            name=name, tool_input=tool_input
+        )
+        predecessors = [self._last_write] if self._last_write else []
+        if not read_only:
+            predecessors += self._reads_since_write
+        task = asyncio.create_task(
+            self._run_after(predecessors, tool_use_id, name, tool_input)
+        )
+        self.tasks.append(task)
+        if read_only:
+            self._reads_since_write.append(task)
+        else:
+            self._last_write = task
+            self._reads_since_write = []
+
+    async def _run_after(
+        self,
+        predecessors: list[asyncio.Task[BetaToolResultBlockParam]],
+        tool_use_id: str,
+        name: str,
+        tool_input: dict[str, Any],
+    ) -> BetaToolResultBlockParam:
+        if predecessors:
+            # asyncio.wait, unlike gather, doesn't cancel the predecessors if this
+            # task is cancelled, and a predecessor's failure surfaces from its own task
+            await asyncio.wait(predecessors)
+        result = await self._tool_collection.run(name=name, tool_input=tool_input)
+        self._tool_output_callback(result, tool_use_id)
+        # image re-encoding is CPU-bound, keep it off the event loop
+        return await asyncio.to_thread(_make_api_tool_result, result, tool_use_id)
+
+
+async def _run_tools(
+    tool_collection: ToolCollection,
+    tool_uses: list[tuple[str, str, dict[str, Any]]],
+    tool_output_callback: Callable[[ToolResult, str], None],
+) -> list[BetaToolResultBlockParam]:
+    """
+    Run the tool_use blocks from a single assistant turn through a _ToolScheduler,
+    returning their tool_result blocks in the order the model emitted them.
+    """
+    scheduler = _ToolScheduler(tool_collection, tool_output_callback)
+    for tool_use_id, name, tool_input in tool_uses:
+        scheduler.submit(tool_use_id, name, tool_input)
+    return list(await asyncio.gather(*scheduler.tasks))
+
+
+def _block_type(block: Any) -> str | None:
+    """
+    The `type` of a content block param, or None for anything that isn't a plain dict
+    (such as SDK model objects, which the block filters here skip).
+    """
+    return block.get("type") if type(block) is dict else None
+
+
+def _restore_ints(value: Any) -> Any:
+    """
+    Turn whole-number floats back into ints, recursively. Gemini args arrive as a
+    protobuf Struct, which stores every number as a float, while the tools expect
+    ints for things like coordinates.
+    """
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, list):
+        return [_restore_ints(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _restore_ints(item) for key, item in value.items()}
+    return value
+
+
+def _extract_text(content: str | list[Any]) -> str:
+    """Join the text blocks of a message's content, for providers that only take text."""
+    if isinstance(content, str):
+        return content
+    return "\n".join(
+        block["text"]
+        for block in content
+        if _block_type(block) == "text"
+    )
+
+
+def _inject_prompt_caching(
+    messages: list[BetaMessageParam],
+    breakpoints: int = 2,
+):
+    """
+    Set cache breakpoints on the most recent `breakpoints` user turns so the growing
+    conversation prefix (including tool results) is read from cache on the next turn.
+    The system prompt and tool definitions hold the other two of the four breakpoints
+    the API allows.
+    """
+    breakpoints_remaining = breakpoints
+    for message in reversed(messages):
+        if message["role"] != "user" or not isinstance(
+            content := message["content"], list
+        ):
+            continue
+        if not content or not isinstance(content[-1], dict):
+            continue
+        if breakpoints_remaining:
+            breakpoints_remaining -= 1
+            content[-1]["cache_control"] = BetaCacheControlEphemeralParam(
+                type="ephemeral"
+            )
+        else:
+            content[-1].pop("cache_control", None)
+            # only one turn falls out of the window per loop iteration
+            break
+
+
+def _collect_image_tool_results(
+    messages: list[BetaMessageParam],
+) -> tuple[list[tuple[ToolResultBlockParam, list[int]]], int]:
+    """
+    One walk over the conversation, oldest first, that both counts tool_result images
+    and remembers where they sit; tool_results with no images left are not returned.
+    """
+    image_tool_results: list[tuple[ToolResultBlockParam, list[int]]] = []
+    total_images = 0
+    for message in messages:
+        message_content = message["content"]
+        if not isinstance(message_content, list):
+            continue
+        for item in message_content:
+            if _block_type(item) != "tool_result":
+                continue
+            image_indices = []
+            for i, content in enumerate(item.get("content", ())):
+                if _block_type(content) == "image":
+                    image_indices.append(i)
+            if image_indices:
+                image_tool_results.append(
+                    (cast(ToolResultBlockParam, item), image_indices)
+                )
+                total_images += len(image_indices)
+    return image_tool_results, total_images
+
+
+def _maybe_summarize_old_images(
+    messages: list[BetaMessageParam],
+    images_to_keep: int,
+    min_replacement_threshold: int = 10,
+):
+    """
+    Replace all but the final `images_to_keep` tool_result images in place with a
+    short text marker carrying the image's hash, so the model still sees that a
+    screenshot was taken without the image being re-sent every turn. Like
+    _maybe_filter_to_n_most_recent_images, replacements happen in chunks of
+    min_replacement_threshold to reduce the amount we break the prompt cache.
+    """
+    image_tool_results, total_images = _collect_image_tool_results(messages)
+
+    images_to_replace = total_images - images_to_keep
+    images_to_replace -= images_to_replace % min_replacement_threshold
+    if images_to_replace <= 0:
+        return
+
+    for tool_result, image_indices in image_tool_results:
+        if images_to_replace <= 0:
+            break
+        to_replace = set(image_indices[:images_to_replace])
+        tool_result["content"] = [
+            _image_marker(content) if i in to_replace else content
+            for i, content in enumerate(tool_result["content"])
+        ]
+        images_to_replace -= len(to_replace)
+
+
+def _image_marker(image_block: BetaImageBlockParam) -> BetaTextBlockParam:
+    """A text stand-in for an image block that is no longer worth re-sending."""
+    # tool_result images are always base64, see _make_api_tool_result
+    digest = hashlib.sha256(image_block["source"]["data"].encode()).hexdigest()[:16]
+    return {"type": "text", "text": f"[screenshot omitted: sha256={digest}]"}
+
+
 def _maybe_filter_to_n_most_recent_images(
     messages: list[BetaMessageParam],
     images_to_keep: int,
@@ -266,39 +622,25 @@ def _maybe_filter_to_n_most_recent_images(
     if images_to_keep is None:
         return messages
 
-    tool_result_blocks = cast(
-        list[ToolResultBlockParam],
-        [
-            item
-            for message in messages
-            for item in (
-                message["content"] if isinstance(message["content"], list) else []
-            )
-            if isinstance(item, dict) and item.get("type") == "tool_result"
-        ],
-    )
-
-    total_images = sum(
-        1
-        for tool_result in tool_result_blocks
-        for content in tool_result.get("content", [])
-        if isinstance(content, dict) and content.get("type") == "image"
-    )
+    image_tool_results, total_images = _collect_image_tool_results(messages)
 
     images_to_remove = total_images - images_to_keep
     # for better cache behavior, we want to remove in chunks
     images_to_remove -= images_to_remove % min_removal_threshold
-
-    for tool_result in tool_result_blocks:
-        if isinstance(tool_result.get("content"), list):
-            new_content = []
-            for content in tool_result.get("content", []):
-                if isinstance(content, dict) and content.get("type") == "image":
-                    if images_to_remove > 0:
-                        images_to_remove -= 1
-                        continue
-                new_content.append(content)
-            tool_result["content"] = new_content
+    if images_to_remove <= 0:
+        return
+
+    # remove the oldest images first, stopping once the chunk has been dropped
+    for tool_result, image_indices in image_tool_results:
+        if images_to_remove <= 0:
+            break
+        to_drop = set(image_indices[:images_to_remove])
+        tool_result["content"] = [
+            content
+            for i, content in enumerate(tool_result["content"])
+            if i not in to_drop
+        ]
+        images_to_remove -= len(to_drop)
 
 
 def _make_api_tool_result(
@@ -319,13 +661,14 @@ def _make_api_tool_result(
                 }
             )
         if result.base64_image:
+            media_type, data = _compress_image(result.base64_image)
             tool_result_content.append(
                 {
                     "type": "image",
                     "source": {
                         "type": "base64",
-                        "media_type": "image/png",
-                        "data": result.base64_image,
+                        "media_type": media_type,
+                        "data": data,
                     },
                 }
             )
@@ -337,6 +680,25 @@ def _make_api_tool_result(
     }
 
 
+def _compress_image(base64_image: str) -> tuple[str, str]:
+    """
+    Shrink a base64 PNG screenshot to at most MAX_IMAGE_DIMENSION per side and
+    re-encode it as WebP (or JPEG), returning the media type and the new base64 data.
+    """
+    image = Image.open(io.BytesIO(base64.b64decode(base64_image)))
+    if max(image.size) > MAX_IMAGE_DIMENSION:
+        image.thumbnail((MAX_IMAGE_DIMENSION, MAX_IMAGE_DIMENSION))
+    image = image.convert("RGB")
+    buffer = io.BytesIO()
+    if WEBP_SUPPORTED:
+        image.save(buffer, format="WEBP", quality=WEBP_QUALITY, method=4)
+        media_type = "image/webp"
+    else:
+        image.save(buffer, format="JPEG", quality=JPEG_QUALITY)
+        media_type = "image/jpeg"
+    return media_type, base64.b64encode(buffer.getvalue()).decode()
+
+
 def _maybe_prepend_system_tool_result(result: ToolResult, result_text: str):
     if result.system:
         result_text = f"<system>{result.system}</system>\n{result_text}"
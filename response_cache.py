@@ -0,0 +1,172 @@
+"""
+Opt-in caches that let sampling_loop reuse an earlier assistant turn instead of calling
+the provider again.
+"""
+
+import hashlib
+from collections import OrderedDict
+from typing import Any
+from uuid import uuid4
+
+import orjson
+from anthropic.types.beta import BetaContentBlock, BetaMessageParam
+
+SEMANTIC_CACHE_MODEL = "all-MiniLM-L6-v2"
+
+
+def _as_dict(block: Any) -> Any:
+    """Content blocks are either plain params or SDK models; normalize to dicts."""
+    return block.model_dump() if hasattr(block, "model_dump") else block
+
+
+def _canonical_json(obj: Any) -> bytes:
+    """Serialize `obj` with sorted keys, so equal structures hash the same."""
+    return orjson.dumps(obj, default=_as_dict, option=orjson.OPT_SORT_KEYS)
+
+
+def _user_text(message: BetaMessageParam) -> str | None:
+    """
+    The text of a plain user-text turn, or None if the turn carries tool results or
+    no text. Tool-result turns are mostly screenshots and click acknowledgements with
+    little or no text, so any two of them would look identical to a text embedding.
+    """
+    content = message["content"]
+    if isinstance(content, str):
+        return content or None
+    parts = []
+    for block in map(_as_dict, content):
+        if not isinstance(block, dict):
+            continue
+        if block.get("type") == "tool_result":
+            return None
+        if block.get("type") == "text":
+            parts.append(block["text"])
+    return "\n".join(parts) or None
+
+
+def _turn_structure(messages: list[BetaMessageParam]) -> tuple:
+    """
+    The shape of the latest exchange: the block types of the last user turn and the
+    tools the assistant called just before it. Cached turns are only replayed when
+    this matches exactly.
+    """
+    last_user = messages[-1]["content"]
+    user_types = (
+        ("text",)
+        if isinstance(last_user, str)
+        else tuple(_as_dict(block).get("type") for block in last_user)
+    )
+    tool_names: tuple = ()
+    if len(messages) > 1 and isinstance(messages[-2]["content"], list):
+        tool_names = tuple(
+            block.get("name")
+            for block in map(_as_dict, messages[-2]["content"])
+            if block.get("type") == "tool_use"
+        )
+    return user_types, tool_names
+
+
+class SemanticResponseCache:
+    """
+    Replays an earlier assistant turn when the latest user turn is semantically close
+    to one seen before, under the same system prompt and tool-call structure.
+
+    Only plain user-text turns are cached; turns returning tool results always go to
+    the provider, so a replayed action is never fed back into the cache. Similarity
+    ignores what is on screen, so only enable this for repetitive, well-understood
+    workflows. Requires `sentence-transformers`.
+    """
+
+    def __init__(
+        self,
+        model_name: str = SEMANTIC_CACHE_MODEL,
+        threshold: float = 0.95,
+        max_entries: int = 256,
+    ):
+        from sentence_transformers import SentenceTransformer
+
+        self._encoder = SentenceTransformer(model_name)
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._entries: list[tuple[Any, tuple, list[BetaContentBlock]]] = []
+
+    def _embed(self, text: str):
+        return self._encoder.encode(text, normalize_embeddings=True)
+
+    def lookup(
+        self, system: str, messages: list[BetaMessageParam]
+    ) -> list[BetaContentBlock] | None:
+        """Return the content of a cached assistant turn, or None on a miss."""
+        text = _user_text(messages[-1])
+        if text is None:
+            return None
+        structure = (system, _turn_structure(messages))
+        embedding = self._embed(text)
+        best_score, best_content = self.threshold, None
+        for cached_embedding, cached_structure, content in self._entries:
+            if cached_structure != structure:
+                continue
+            # embeddings are normalized, so the dot product is the cosine similarity
+            score = float(embedding @ cached_embedding)
+            if score >= best_score:
+                best_score, best_content = score, content
+        if best_content is None:
+            return None
+        # tool_use ids must be unique within a conversation
+        return [
+            block.model_copy(update={"id": f"toolu_cached_{uuid4().hex}"})
+            if block.type == "tool_use"
+            else block
+            for block in best_content
+        ]
+
+    def store(
+        self,
+        system: str,
+        messages: list[BetaMessageParam],
+        content: list[BetaContentBlock],
+    ):
+        """Remember the assistant turn generated in response to `messages`."""
+        text = _user_text(messages[-1])
+        if text is None:
+            return
+        self._entries.append(
+            (self._embed(text), (system, _turn_structure(messages)), content)
+        )
+        if len(self._entries) > self.max_entries:
+            self._entries.pop(0)
+
+
+class ExactResponseCache:
+    """
+    Replays the assistant turn for a request identical to one already sent: same
+    model, system prompt, tools and messages. Meant for replays and automated runs
+    where an identical request should get an identical turn.
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[bytes, list[Any]] = OrderedDict()
+
+    @staticmethod
+    def key(
+        model: str, system: str, tools: list[Any], messages: list[Any]
+    ) -> bytes:
+        """A stable digest of everything that determines the request."""
+        return hashlib.blake2b(
+            _canonical_json([model, system, tools, messages])
+        ).digest()
+
+    def get(self, key: bytes) -> list[Any] | None:
+        """Return the cached assistant content for `key`, or None on a miss."""
+        content = self._entries.get(key)
+        if content is not None:
+            self._entries.move_to_end(key)
+        return content
+
+    def put(self, key: bytes, content: list[Any]):
+        """Cache the assistant content for `key`, evicting the least recently used."""
+        self._entries[key] = content
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
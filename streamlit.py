@@ -4,6 +4,7 @@ Entrypoint for streamlit, see https://docs.streamlit.io/
 
 import asyncio
 import base64
+import importlib.util
 import os
 import subprocess
 from datetime import datetime
@@ -26,6 +27,7 @@ from loop import (
     APIProvider,
     sampling_loop,
 )
+from response_cache import SemanticResponseCache
 from tools import ToolResult
 from dotenv import load_dotenv
 
@@ -81,10 +83,16 @@ def setup_state():
         st.session_state.tools = {}
     if "only_n_most_recent_images" not in st.session_state:
         st.session_state.only_n_most_recent_images = 10
+    if "only_n_most_recent_full_images" not in st.session_state:
+        st.session_state.only_n_most_recent_full_images = 0
     if "custom_system_prompt" not in st.session_state:
         st.session_state.custom_system_prompt = load_from_storage("system_prompt") or ""
     if "hide_images" not in st.session_state:
         st.session_state.hide_images = False
+    if "stream" not in st.session_state:
+        st.session_state.stream = False
+    if "semantic_cache" not in st.session_state:
+        st.session_state.semantic_cache = False
 
 
 def _reset_model():
@@ -136,6 +144,12 @@ async def main():
             key="only_n_most_recent_images",
             help="To decrease the total tokens sent, remove older screenshots from the conversation",
         )
+        st.number_input(
+            "Only send N most recent images in full",
+            min_value=0,
+            key="only_n_most_recent_full_images",
+            help="Replace older screenshots with a short placeholder instead of removing them, so the model still knows they were taken. 0 disables this",
+        )
         st.text_area(
             "Custom System Prompt Suffix",
             key="custom_system_prompt",
@@ -145,6 +159,17 @@ async def main():
             ),
         )
         st.checkbox("Hide screenshots", key="hide_images")
+        st.checkbox(
+            "Stream responses",
+            key="stream",
+            help="Start each tool as soon as the model finishes writing its call. HTTP exchange logs are not recorded while streaming.",
+        )
+        st.checkbox(
+            "Reuse responses for similar requests (experimental)",
+            key="semantic_cache",
+            disabled=importlib.util.find_spec("sentence_transformers") is None,
+            help="Replay an earlier response when a request closely matches one seen before, skipping the API call. Matching ignores screenshots, so replayed actions may not fit the current screen. Requires sentence-transformers (pip install sentence-transformers).",
+        )
 
         if st.button("Reset", type="primary"):
             with st.spinner("Resetting..."):
@@ -229,9 +254,24 @@ async def main():
                 ),
                 api_key=st.session_state.api_key,
                 only_n_most_recent_images=st.session_state.only_n_most_recent_images,
+                only_n_most_recent_full_images=st.session_state.only_n_most_recent_full_images,
+                stream=st.session_state.stream,
+                semantic_cache=(
+                    _semantic_cache() if st.session_state.semantic_cache else None
+                ),
             )
 
 
+def _semantic_cache() -> SemanticResponseCache:
+    """
+    The semantic cache for this browser session, created on first use. It is kept
+    per session so one user's responses are never replayed into another's chat.
+    """
+    if "semantic_cache_instance" not in st.session_state:
+        st.session_state.semantic_cache_instance = SemanticResponseCache()
+    return st.session_state.semantic_cache_instance
+
+
 def validate_auth(provider: APIProvider, api_key: str | None):
     if provider == APIProvider.ANTHROPIC:
         if not api_key:
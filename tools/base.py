@@ -1,11 +1,48 @@
 from abc import ABCMeta, abstractmethod
-from dataclasses import dataclass, fields, replace
-from typing import Any, Dict
+from dataclasses import dataclass, replace
+from functools import cached_property
+from typing import Any
 
 from anthropic.types.beta import BetaToolUnionParam
 from google.generativeai.types import FunctionDeclaration
 
 
+# JSON Schema type names that Gemini spells differently
+_GEMINI_TYPE_MAPPING = {
+    "integer": "number",
+    "array": "list",
+}
+
+
+def _convert_params(params: dict) -> dict:
+    """
+    Convert a JSON Schema parameters object to Gemini's format, marking required
+    properties and renaming types. Builds a new tree and leaves `params` untouched.
+    """
+    if "type" not in params:
+        return params
+
+    converted = dict(params)
+    stack = [converted]
+    while stack:
+        node = stack.pop()
+        node["type"] = _GEMINI_TYPE_MAPPING.get(node["type"], node["type"])
+        if "properties" not in node:
+            continue
+        required = node.get("required", [])
+        properties = {}
+        for prop_name, prop in node["properties"].items():
+            if isinstance(prop, dict):
+                prop = dict(prop)
+                if prop_name in required:
+                    prop["required"] = True
+                if "type" in prop:
+                    stack.append(prop)
+            properties[prop_name] = prop
+        node["properties"] = properties
+    return converted
+
+
 class BaseAnthropicTool(metaclass=ABCMeta):
     """Abstract base class for Anthropic and Gemini-defined tools."""
 
@@ -20,51 +57,32 @@ class BaseAnthropicTool(metaclass=ABCMeta):
     ) -> BetaToolUnionParam:
         raise NotImplementedError
 
-    def to_gemini_tool(self) -> FunctionDeclaration:
-        """Convert the tool definition to Gemini's FunctionDeclaration format."""
-        anthropic_params = self.to_params()
-        
+    def is_read_only(self, **kwargs) -> bool:
+        """
+        Whether a call with these arguments only observes the machine, so it may
+        overlap other read-only calls from the same turn.
+        """
+        return False
+
+    @cached_property
+    def params(self) -> BetaToolUnionParam:
+        """The tool definition, built once per tool instance."""
+        return self.to_params()
+
+    @cached_property
+    def gemini_tool(self) -> FunctionDeclaration:
+        """The tool definition in Gemini's FunctionDeclaration format, built once."""
+        anthropic_params = self.params
+
         if not isinstance(anthropic_params, dict):
             raise ValueError("Tool params must be a dictionary")
-        
+
         function_name = anthropic_params.get("function", {}).get("name", "")
         description = anthropic_params.get("function", {}).get("description", "")
         parameters = anthropic_params.get("function", {}).get("parameters", {})
-        
-        # Convert JSON Schema type parameters to Gemini's format
-        def convert_params(params: Dict) -> Dict:
-            if "type" not in params:
-                return params
-            
-            # Handle required fields
-            required = params.get("required", [])
-            properties = params.get("properties", {})
-            
-            # Mark required fields in properties
-            for prop_name, prop_details in properties.items():
-                if prop_name in required:
-                    prop_details["required"] = True
-            
-            # Convert type names if needed
-            type_mapping = {
-                "integer": "number",
-                "array": "list",
-                # Add more mappings if needed
-            }
-            
-            params_type = params["type"]
-            if params_type in type_mapping:
-                params["type"] = type_mapping[params_type]
-            
-            if "properties" in params:
-                for prop in params["properties"].values():
-                    if isinstance(prop, dict):
-                        convert_params(prop)
-            
-            return params
-        
-        converted_parameters = convert_params(parameters)
-        
+
+        converted_parameters = _convert_params(parameters)
+
         return FunctionDeclaration(
             name=function_name,
             description=description,
@@ -72,6 +90,16 @@ class BaseAnthropicTool(metaclass=ABCMeta):
         )
 
 
+def _combine_fields(
+    field: str | None, other_field: str | None, concatenate: bool = True
+):
+    if field and other_field:
+        if concatenate:
+            return field + other_field
+        raise ValueError("Cannot combine tool results")
+    return field or other_field
+
+
 @dataclass(kw_only=True, frozen=True)
 class ToolResult:
     """Represents the result of a tool execution."""
@@ -82,23 +110,14 @@ class ToolResult:
     system: str | None = None
 
     def __bool__(self):
-        return any(getattr(self, field.name) for field in fields(self))
+        return bool(self.output or self.error or self.base64_image or self.system)
 
     def __add__(self, other: "ToolResult"):
-        def combine_fields(
-            field: str | None, other_field: str | None, concatenate: bool = True
-        ):
-            if field and other_field:
-                if concatenate:
-                    return field + other_field
-                raise ValueError("Cannot combine tool results")
-            return field or other_field
-
         return ToolResult(
-            output=combine_fields(self.output, other.output),
-            error=combine_fields(self.error, other.error),
-            base64_image=combine_fields(self.base64_image, other.base64_image, False),
-            system=combine_fields(self.system, other.system),
+            output=_combine_fields(self.output, other.output),
+            error=_combine_fields(self.error, other.error),
+            base64_image=_combine_fields(self.base64_image, other.base64_image, False),
+            system=_combine_fields(self.system, other.system),
         )
 
     def replace(self, **kwargs):
@@ -17,12 +17,16 @@ class ToolCollection:
 
     def __init__(self, *tools: BaseAnthropicTool):
         self.tools = tools
-        self.tool_map = {tool.to_params()["name"]: tool for tool in tools}
+        self.tool_map = {tool.params["name"]: tool for tool in tools}
 
     def to_params(
         self,
     ) -> list[BetaToolUnionParam]:
-        return [tool.to_params() for tool in self.tools]
+        return [tool.params for tool in self.tools]
+
+    def is_read_only(self, *, name: str, tool_input: dict[str, Any]) -> bool:
+        tool = self.tool_map.get(name)
+        return tool is not None and tool.is_read_only(**tool_input)
 
     async def run(self, *, name: str, tool_input: dict[str, Any]) -> ToolResult:
         tool = self.tool_map.get(name)
@@ -63,6 +63,10 @@ def chunks(s: str, chunk_size: int) -> list[str]:
     return [s[i : i + chunk_size] for i in range(0, len(s), chunk_size)]
 
 
+def _read_base64(path: Path) -> str:
+    return base64.b64encode(path.read_bytes()).decode()
+
+
 class ComputerTool(BaseAnthropicTool):
     """
     A tool that allows the agent to interact with the screen, keyboard, and mouse of the current macOS computer.
@@ -90,6 +94,9 @@ class ComputerTool(BaseAnthropicTool):
     def to_params(self) -> BetaToolComputerUse20241022Param:
         return {"name": self.name, "type": self.api_type, **self.options}
 
+    def is_read_only(self, **kwargs) -> bool:
+        return kwargs.get("action") in ("screenshot", "cursor_position")
+
     def __init__(self):
         super().__init__()
 
@@ -236,7 +243,7 @@ class ComputerTool(BaseAnthropicTool):
 
         if path.exists():
             return result.replace(
-                base64_image=base64.b64encode(path.read_bytes()).decode()
+                base64_image=await asyncio.to_thread(_read_base64, path)
             )
         raise ToolError(f"Failed to take screenshot: {result.error}")
 
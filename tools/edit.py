@@ -38,6 +38,9 @@ class EditTool(BaseAnthropicTool):
             "type": self.api_type,
         }
 
+    def is_read_only(self, **kwargs) -> bool:
+        return kwargs.get("command") == "view"
+
     async def __call__(
         self,
         *,